@@ -3,75 +3,239 @@
 Flask app: upload FASTA/GBK -> run antiSMASH via Docker -> parse .gbk -> show proteins.
 Notas:
 - Monta uploads folder em /input e runs folder em /output dentro do container.
+- Um container antiSMASH fica ativo (antismash_worker) e cada análise roda via docker exec.
 - antiSMASH CLI na imagem antismash/standalone espera o arquivo como primeiro arg
   e um --output-dir (neste caso usamos /output/<run_name>).
 - Requer Docker Desktop rodando e imagem antismash/standalone:latest disponível.
 """
 import os
 import uuid
+import hashlib
 import shutil
 import subprocess
 import threading
 import time
 import json
+import mmap
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, jsonify
+from typing import NamedTuple, Optional
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, jsonify, Response
 from werkzeug.utils import secure_filename
-from Bio import SeqIO
+from flask_executor import Executor
+
+# gb-io (parser GenBank em Rust) é bem mais rápido; Biopython fica como fallback
+try:
+    import gb_io
+except ImportError:
+    gb_io = None
+    from Bio import SeqIO
+
+# orjson serializa o results.json bem mais rápido; json da stdlib fica como fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_FOLDER = BASE_DIR / "uploads"
 RUNS_FOLDER = BASE_DIR / "runs"
+HASH_INDEX_FOLDER = RUNS_FOLDER / "by_hash"  # hash do upload -> run já concluído
 ALLOWED_EXTENSIONS = {"fasta", "fa", "fna", "txt", "ffn", "fas", "gb", "gbk"}
 
 DOCKER_IMAGE = "antismash/standalone:latest"
+DOCKER_WORKER_NAME = "antismash_worker"
 
 # Ensure folders exist
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 RUNS_FOLDER.mkdir(parents=True, exist_ok=True)
+HASH_INDEX_FOLDER.mkdir(parents=True, exist_ok=True)
 
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_FOLDER)
 app.secret_key = os.environ.get("FLASK_SECRET", "troque_esta_chave_em_producao")
+# Atrás de um servidor com suporte a X-Sendfile (Apache mod_xsendfile, lighttpd) os downloads
+# são enviados pelo próprio servidor via sendfile, sem passar pelo Python
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+
+# Pool limitado para as análises: no máximo EXECUTOR_MAX_WORKERS containers ao mesmo tempo,
+# os demais uploads ficam na fila
+app.config["EXECUTOR_TYPE"] = "thread"
+app.config["EXECUTOR_MAX_WORKERS"] = max(1, (os.cpu_count() or 2) // 2)
+executor = Executor(app)
 
 # Sistema de tracking de progresso
+# Com REDIS_URL o progresso fica no Redis (compartilhado entre workers do gunicorn);
+# sem ele, num dict em memória (servidor de processo único)
+PROGRESS_TTL = 3600  # segundos
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    import redis
+    redis_client = redis.Redis.from_url(REDIS_URL)
+else:
+    redis_client = None
 progress_data = {}
 
+# Log do antiSMASH: só 1 a cada LOG_EVERY_N_LINES linhas (e as de progresso) vão para o logger;
+# as últimas LOG_TAIL_LINES ficam em memória e são logadas se a análise falhar
+LOG_EVERY_N_LINES = 100
+LOG_TAIL_LINES = 200
+
+# Palavras-chave (já em minúsculas) para detectar progresso no log do antiSMASH,
+# na ordem de prioridade
+PROGRESS_KEYWORDS = (
+    ("reading sequence", 15),
+    ("downloading", 20),
+    ("finding genes", 30),
+    ("running gene", 40),
+    ("detecting", 50),
+    ("predicting", 60),
+    ("creating", 70),
+    ("generating", 80),
+    ("writing", 90),
+)
+
+class Progress(NamedTuple):
+    """Estado de um run; o timestamp (epoch) só é formatado quando a API é consultada"""
+    step: str
+    message: str
+    percentage: Optional[int]
+    ts: float
+    
+    def to_dict(self):
+        return {
+            'step': self.step,
+            'message': self.message,
+            'percentage': self.percentage,
+            'timestamp': datetime.utcfromtimestamp(self.ts).isoformat()
+        }
+
 def update_progress(run_id, step, message, percentage=None):
     """Atualiza o progresso de um run específico"""
-    progress_data[run_id] = {
-        'step': step,
-        'message': message,
-        'percentage': percentage,
-        'timestamp': datetime.utcnow().isoformat()
-    }
+    progress = Progress(step, message, percentage, time.time())
+    if redis_client is not None:
+        redis_client.setex(f"progress:{run_id}", PROGRESS_TTL, json.dumps(progress))
+    else:
+        progress_data[run_id] = progress
+
+def get_run_progress(run_id):
+    """Retorna o Progress de um run, ou None se não existir"""
+    if redis_client is not None:
+        raw = redis_client.get(f"progress:{run_id}")
+        return Progress(*json.loads(raw)) if raw else None
+    return progress_data.get(run_id)
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def write_results(results_file: Path, data):
+    """Grava o results.json (compacto, UTF-8)"""
+    if orjson is not None:
+        results_file.write_bytes(orjson.dumps(data))
+    else:
+        results_file.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+def read_results(results_file: Path):
+    """Lê o results.json"""
+    if orjson is not None:
+        return orjson.loads(results_file.read_bytes())
+    return json.loads(results_file.read_text(encoding="utf-8"))
+
+def write_protein_fasta(fasta_file: Path, proteins):
+    """
+    Grava as sequências em proteins.fasta (>record_id|gene) e as remove dos dicts,
+    guardando em cada proteína o offset (em bytes) da sequência no arquivo.
+    """
+    offset = 0
+    with open(fasta_file, "wb") as out:
+        for protein in proteins:
+            header = f">{protein['record_id']}|{protein['gene']}\n".encode("utf-8")
+            seq = protein.pop("protein_seq").encode("ascii")
+            protein["seq_offset"] = offset + len(header)
+            out.write(header)
+            out.write(seq)
+            out.write(b"\n")
+            offset += len(header) + len(seq) + 1
+
+def find_cached_run(file_hash):
+    """Retorna o run_name de uma análise concluída do mesmo arquivo, ou None"""
+    index_file = HASH_INDEX_FOLDER / file_hash
+    if not index_file.exists():
+        return None
+    run_name = index_file.read_text(encoding="utf-8").strip()
+    if (RUNS_FOLDER / run_name / "results.json").exists():
+        return run_name
+    return None
+
+worker_lock = threading.Lock()
+
+def antismash_worker_state():
+    """
+    Estado do container antismash_worker: (exists, running).
+    exists=False quando o docker inspect falha (container inexistente).
+    """
+    state = subprocess.run(["docker", "inspect", "-f", "{{.State.Running}}", DOCKER_WORKER_NAME],
+                           capture_output=True, text=True)
+    return state.returncode == 0, state.stdout.strip() == "true"
+
+def ensure_antismash_worker():
+    """
+    Garante que o container antismash_worker está rodando (sleep infinity),
+    criando-o se necessário. As análises entram nele via docker exec, sem pagar
+    a criação de um container novo a cada upload.
+      docker run -d --name antismash_worker -v "<uploads>:/input" -v "<runs>:/output" --entrypoint sleep antismash/standalone:latest infinity
+    O lock só vale dentro do processo: outro worker do gunicorn pode criar o container
+    ao mesmo tempo, então uma falha no docker run é tolerada se o container subir.
+    """
+    with worker_lock:
+        exists, running = antismash_worker_state()
+        if running:
+            return
+        if exists:
+            # Existe mas está parado: recriar para garantir os volumes atuais
+            subprocess.run(["docker", "rm", "-f", DOCKER_WORKER_NAME], capture_output=True)
+        
+        app.logger.info(f"Starting {DOCKER_WORKER_NAME} container")
+        started = subprocess.run([
+            "docker", "run", "-d", "--name", DOCKER_WORKER_NAME,
+            "-v", f"{UPLOAD_FOLDER.resolve()}:/input",
+            "-v", f"{RUNS_FOLDER.resolve()}:/output",
+            "--entrypoint", "sleep",
+            DOCKER_IMAGE, "infinity"
+        ], capture_output=True, text=True)
+        if started.returncode == 0:
+            return
+        
+        # Provável conflito de nome: outro processo criou o container; aguardar ele subir
+        for _ in range(10):
+            if antismash_worker_state()[1]:
+                return
+            time.sleep(1)
+        raise RuntimeError(f"Não foi possível iniciar o container {DOCKER_WORKER_NAME}: {started.stderr.strip()}")
+
 def run_antismash_docker(saved_path: Path, run_name: str, run_id: str, genefinder: str = "prodigal"):
     """
-    Run antiSMASH inside Docker with progress tracking.
-    Mount uploads -> /input and runs -> /output.
+    Run antiSMASH inside the antismash_worker container with progress tracking.
+    The container mounts uploads -> /input and runs -> /output.
     Command executed:
-      docker run --rm -v "<uploads>:/input" -v "<runs>:/output" antismash/standalone:latest <input_filename> --genefinding-tool prodigal --output-dir /output/<run_name>
+      docker exec -w /input antismash_worker antismash <input_filename> --genefinding-tool prodigal --output-dir /output/<run_name>
     Returns host_run_dir (Path)
     """
     update_progress(run_id, "setup", "Preparando ambiente Docker...", 5)
+    ensure_antismash_worker()
     
-    input_parent = str(UPLOAD_FOLDER.resolve())
-    runs_parent = str(RUNS_FOLDER.resolve())
     input_filename = saved_path.name
 
     host_run_dir = RUNS_FOLDER / run_name
     host_run_dir.mkdir(parents=True, exist_ok=True)
 
     docker_cmd = [
-        "docker", "run", "--rm",
-        "-v", f"{input_parent}:/input",
-        "-v", f"{runs_parent}:/output",
-        DOCKER_IMAGE,
+        "docker", "exec", "-w", "/input", DOCKER_WORKER_NAME,
+        "antismash",
         input_filename,
         "--genefinding-tool", genefinder,
         "--output-dir", f"/output/{run_name}"
@@ -79,191 +243,179 @@ def run_antismash_docker(saved_path: Path, run_name: str, run_id: str, genefinde
 
     update_progress(run_id, "running", "Executando antiSMASH...", 10)
     
-    # Palavras-chave para detectar progresso no log
-    progress_keywords = {
-        "Reading sequence": 15,
-        "Downloading": 20,
-        "Finding genes": 30,
-        "Running gene": 40,
-        "Detecting": 50,
-        "Predicting": 60,
-        "Creating": 70,
-        "Generating": 80,
-        "Writing": 90
-    }
-    
     # Run and stream output with progress tracking
-    proc = subprocess.Popen(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    
-    for line in proc.stdout:
-        line_clean = line.rstrip()
-        app.logger.info(line_clean)
-        
-        # Detectar progresso baseado em palavras-chave
-        for keyword, percentage in progress_keywords.items():
-            if keyword.lower() in line_clean.lower():
-                update_progress(run_id, "running", f"antiSMASH: {line_clean[:100]}...", percentage)
-                break
+    proc = subprocess.Popen(docker_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=65536)
     
-    proc.wait()
+    log_tail = deque(maxlen=LOG_TAIL_LINES)
+    try:
+        for line_number, line in enumerate(proc.stdout, 1):
+            line_clean = line.rstrip()
+            log_tail.append(line_clean)
+            
+            # Detectar progresso baseado em palavras-chave
+            line_lower = line_clean.lower()
+            progress_line = False
+            for keyword, percentage in PROGRESS_KEYWORDS:
+                if keyword in line_lower:
+                    update_progress(run_id, "running", f"antiSMASH: {line_clean[:100]}...", percentage)
+                    progress_line = True
+                    break
+            
+            if progress_line or line_number % LOG_EVERY_N_LINES == 0:
+                app.logger.info(line_clean)
+    finally:
+        # Fecha o pipe mesmo se o loop falhar, para não vazar o descritor
+        proc.stdout.close()
+        proc.wait()
     
     if proc.returncode != 0:
+        app.logger.error("antiSMASH output (last lines):\n" + "\n".join(log_tail))
         update_progress(run_id, "error", f"antiSMASH falhou com código {proc.returncode}", None)
         raise RuntimeError(f"antiSMASH failed with exit code {proc.returncode}")
     
     update_progress(run_id, "parsing", "Processando resultados...", 95)
     return host_run_dir
 
-def parse_gbk_for_proteins(run_dir: Path):
+BIOPYTHON_STRANDS = {1: "+", -1: "-"}
+
+def _gb_io_location(location):
+    """Converte uma Location do gb-io em (start, end, strand)"""
+    if hasattr(location, "locations"):  # Join / Order
+        parts = [_gb_io_location(loc) for loc in location.locations]
+        return min(p[0] for p in parts), max(p[1] for p in parts), parts[0][2]
+    if isinstance(location, gb_io.Complement):
+        start, end, strand = _gb_io_location(location.location)
+        return start, end, "-" if strand == "+" else "+"
+    return location.start, location.end, location.strand
+
+def read_gbk_records(gbk: Path):
     """
-    Parse all .gbk files under run_dir and return list of protein dicts.
-    Prioritizes functional annotations from region files over main sequence file.
-    Fields: record_id, gene, product, protein_seq, aa_length, location, source_file
+    Itera os records de um arquivo GenBank como (record_id, sequence_length, features).
+    Cada feature é uma tupla (type, location, qualifiers), com location como
+    (start, end, strand) - strand "+", "-" ou None - e qualifiers como dict de listas.
+    Usa gb-io quando instalado, senão Biopython.
     """
-    proteins = []
-    proteins_by_gene = {}  # Para agrupar por gene e priorizar anotações
+    if gb_io is None:
+        for rec in SeqIO.parse(str(gbk), "genbank"):
+            features = [
+                (feat.type,
+                 (int(feat.location.start), int(feat.location.end), BIOPYTHON_STRANDS.get(feat.location.strand)),
+                 feat.qualifiers)
+                for feat in rec.features
+            ]
+            yield rec.id, len(rec.seq), features
+        return
+
+    for rec in gb_io.iter(str(gbk)):
+        features = []
+        for feat in rec.features:
+            qualifiers = {}
+            for qualifier in feat.qualifiers:
+                # Valores multi-linha: mesmo tratamento do Biopython
+                value = (qualifier.value or "").replace("\n", "" if qualifier.key == "translation" else " ")
+                qualifiers.setdefault(qualifier.key, []).append(value)
+            features.append((feat.kind, _gb_io_location(feat.location), qualifiers))
+        yield rec.version or rec.accession or rec.name, len(rec.sequence), features
+
+def first_qualifier(qualifiers, key):
+    """Primeiro valor de um qualifier, ou "" se ausente (sem alocar lista default)"""
+    values = qualifiers.get(key)
+    return values[0] if values else ""
+
+def extract_functional_annotation(qualifiers):
+    """Extrai anotação funcional de vários campos possíveis"""
+    # Prioridade: product > gene_functions > gene_kind
+    product = first_qualifier(qualifiers, "product")
+    if product.strip():
+        return product.strip()
     
-    # Primeiro, processar arquivo principal para obter todas as proteínas
-    main_files = [gbk for gbk in run_dir.rglob("*.gbk") if not gbk.name.startswith("NC_") or "region" not in gbk.name]
-    region_files = [gbk for gbk in run_dir.rglob("*.gbk") if gbk.name.startswith("NC_") and "region" in gbk.name]
+    # Extrair de gene_functions (comum no antiSMASH)
+    gene_functions = qualifiers.get("gene_functions", [])
+    if gene_functions:
+        # Extrair a parte mais informativa
+        for func in gene_functions:
+            func_lower = func.lower()
+            if "biosynthetic" in func_lower:
+                # Extrair o tipo de função
+                if ":" in func:
+                    func_type = func.split(":")[-1].strip()
+                    if func_type:
+                        return func_type
+                elif ")" in func:
+                    func_type = func.split(")")[-1].strip()
+                    if func_type:
+                        return func_type
     
-    app.logger.info(f"Found {len(main_files)} main files and {len(region_files)} region files")
+    # Extrair de gene_kind
+    gene_kind = first_qualifier(qualifiers, "gene_kind")
+    if gene_kind.strip():
+        return gene_kind.strip()
     
-    def extract_functional_annotation(qualifiers):
-        """Extrai anotação funcional de vários campos possíveis"""
-        # Prioridade: product > gene_functions > gene_kind
-        product = qualifiers.get("product", [""])[0]
-        if product.strip():
-            return product.strip()
-        
-        # Extrair de gene_functions (comum no antiSMASH)
-        gene_functions = qualifiers.get("gene_functions", [])
-        if gene_functions:
-            # Extrair a parte mais informativa
-            for func in gene_functions:
-                if "biosynthetic" in func.lower():
-                    # Extrair o tipo de função
-                    if ":" in func:
-                        func_type = func.split(":")[-1].strip()
-                        if func_type:
-                            return func_type
-                    elif ")" in func:
-                        func_type = func.split(")")[-1].strip()
-                        if func_type:
-                            return func_type
-        
-        # Extrair de gene_kind
-        gene_kind = qualifiers.get("gene_kind", [""])[0]
-        if gene_kind.strip():
-            return gene_kind.strip()
-        
-        # Extrair de sec_met_domain
-        sec_met_domain = qualifiers.get("sec_met_domain", [])
-        if sec_met_domain:
-            for domain in sec_met_domain:
-                if "(" in domain:
-                    domain_name = domain.split("(")[0].strip()
-                    if domain_name:
-                        return f"domain: {domain_name}"
-        
-        return ""
-    
-    # Processar arquivos principais primeiro
-    for gbk in sorted(main_files):
-        try:
-            for rec in SeqIO.parse(str(gbk), "genbank"):
-                for feat in rec.features:
-                    if feat.type.lower() == "cds":
-                        qualifiers = feat.qualifiers
-                        prot_seq = qualifiers.get("translation", [""])[0]
-                        gene = qualifiers.get("gene", qualifiers.get("locus_tag", [""]))[0]
-                        product = extract_functional_annotation(qualifiers)
-                        location = str(feat.location)
-                        aa_len = len(prot_seq)
-                        
-                        # Criar chave única baseada em gene e localização
-                        key = f"{gene}_{location}"
-                        
-                        protein_data = {
-                            "record_id": rec.id,
-                            "gene": gene,
-                            "product": product,
-                            "protein_seq": prot_seq,
-                            "aa_length": aa_len,
-                            "location": location,
-                            "source_file": gbk.name,
-                            "is_from_region": False
-                        }
-                        proteins_by_gene[key] = protein_data
-        except Exception as e:
-            app.logger.error(f"Error parsing main file {gbk}: {e}")
-    
-    # Processar arquivos region para sobrescrever com anotações funcionais
-    for gbk in sorted(region_files):
-        try:
-            for rec in SeqIO.parse(str(gbk), "genbank"):
-                for feat in rec.features:
-                    if feat.type.lower() == "cds":
-                        qualifiers = feat.qualifiers
-                        prot_seq = qualifiers.get("translation", [""])[0]
-                        gene = qualifiers.get("gene", qualifiers.get("locus_tag", [""]))[0]
-                        product = extract_functional_annotation(qualifiers)
-                        location = str(feat.location)
-                        aa_len = len(prot_seq)
-                        
-                        # Criar chave única baseada em gene e localização
-                        key = f"{gene}_{location}"
-                        
-                        # Se já existe, atualizar com informações do region (prioritárias)
-                        if key in proteins_by_gene:
-                            # Priorizar anotação funcional do region se estiver preenchida
-                            if product.strip():
-                                proteins_by_gene[key]["product"] = product
-                            proteins_by_gene[key]["source_file"] = f"{proteins_by_gene[key]['source_file']} + {gbk.name}"
-                            proteins_by_gene[key]["is_from_region"] = True
-                        else:
-                            # Proteína nova encontrada apenas no region
-                            protein_data = {
-                                "record_id": rec.id,
-                                "gene": gene,
-                                "product": product,
-                                "protein_seq": prot_seq,
-                                "aa_length": aa_len,
-                                "location": location,
-                                "source_file": gbk.name,
-                                "is_from_region": True
-                            }
-                            proteins_by_gene[key] = protein_data
-        except Exception as e:
-            app.logger.error(f"Error parsing region file {gbk}: {e}")
-    
-    # Converter dicionário de volta para lista, removendo campo auxiliar
-    for protein_data in proteins_by_gene.values():
-        protein_data.pop("is_from_region", None)  # Remove campo auxiliar
-        proteins.append(protein_data)
-    
-    app.logger.info(f"Parsed {len(proteins)} total proteins")
-    
-    return proteins
-
-def parse_clusters_from_regions(run_dir: Path):
+    # Extrair de sec_met_domain
+    sec_met_domain = qualifiers.get("sec_met_domain", [])
+    if sec_met_domain:
+        for domain in sec_met_domain:
+            if "(" in domain:
+                domain_name = domain.split("(")[0].strip()
+                if domain_name:
+                    return f"domain: {domain_name}"
+    
+    return ""
+
+def classify_cds(qualifiers):
     """
-    Parse region files to extract cluster information.
-    Returns list of cluster dictionaries with metadata and genes.
+    Extrai os campos de um gene de cluster.
+    Retorna (product, gene_functions, gene_kind, sec_met_domain).
     """
-    clusters = []
-    region_files = [gbk for gbk in run_dir.rglob("*.gbk") if gbk.name.startswith("NC_") and "region" in gbk.name]
+    product = first_qualifier(qualifiers, "product")
+    gene_functions = qualifiers.get("gene_functions", [])
+    gene_kind = first_qualifier(qualifiers, "gene_kind")
+    sec_met_domain = qualifiers.get("sec_met_domain", [])
+    
+    # Extrair função mais específica
+    if not product and gene_functions:
+        for func in gene_functions:
+            if ":" in func:
+                product = func.split(":")[-1].strip()
+                break
     
-    app.logger.info(f"Parsing {len(region_files)} region files for clusters")
+    if not product and gene_kind:
+        product = gene_kind
+    
+    return product, gene_functions, gene_kind, sec_met_domain
+
+# Versões compiladas (Cython) quando o módulo gbk_extract foi construído:
+#   python setup.py build_ext --inplace
+try:
+    from gbk_extract import extract_functional_annotation, classify_cds
+except ImportError:
+    pass
+
+def is_region_file(gbk: Path):
+    """Arquivos region do antiSMASH: NC_*.regionXXX.gbk"""
+    name = gbk.name
+    return name.startswith("NC_") and "region" in name
+
+def _parse_one_gbk(path_str, is_region):
+    """
+    Parse a single .gbk file. Runs in a worker process, so it must stay at module level.
+    Returns (proteins, cluster): proteins is a list of (key, protein dict) in file order;
+    cluster is the cluster dict built from the first record of a region file (None otherwise).
+    """
+    gbk = Path(path_str)
+    proteins = []
+    cluster = None
     
-    for gbk in sorted(region_files):
-        try:
-            for rec in SeqIO.parse(str(gbk), "genbank"):
+    try:
+        for rec_index, (record_id, sequence_length, features) in enumerate(read_gbk_records(gbk)):
+            # Só o primeiro record de cada arquivo region vira cluster
+            cluster_info = None
+            if is_region and rec_index == 0:
                 cluster_info = {
                     "region_name": gbk.stem,  # NC_003888.3.region001
                     "region_number": gbk.stem.split(".")[-1],  # region001
-                    "record_id": rec.id,
-                    "sequence_length": len(rec.seq),
+                    "record_id": record_id,
+                    "sequence_length": sequence_length,
                     "products": [],
                     "cluster_type": "unknown",
                     "genes": [],
@@ -271,57 +423,51 @@ def parse_clusters_from_regions(run_dir: Path):
                     "location_end": None,
                     "source_file": gbk.name
                 }
-                
-                # Extrair informações das features
-                for feat in rec.features:
-                    if feat.type.lower() == "region":
-                        # Informações do cluster principal
-                        qualifiers = feat.qualifiers
-                        products = qualifiers.get("product", [])
-                        if products:
-                            cluster_info["products"] = products
-                            cluster_info["cluster_type"] = " + ".join(products)
-                        
-                        # Localização do cluster
-                        location = str(feat.location)
-                        if "[" in location and ":" in location:
-                            try:
-                                loc_clean = location.replace("[", "").replace("]", "").replace("(+)", "").replace("(-)", "")
-                                start, end = loc_clean.split(":")
-                                cluster_info["location_start"] = int(start)
-                                cluster_info["location_end"] = int(end)
-                            except:
-                                pass
+            
+            # Chaves de feature do GenBank já vêm canônicas ("CDS", "region"): sem .lower()
+            for ftype, location, qualifiers in features:
+                if ftype == "CDS":
+                    prot_seq = first_qualifier(qualifiers, "translation")
+                    gene = first_qualifier(qualifiers, "gene") or first_qualifier(qualifiers, "locus_tag")
+                    product = extract_functional_annotation(qualifiers)
+                    aa_len = len(prot_seq)
+                    
+                    # Criar chave única baseada em gene e localização
+                    key = (gene, location)
                     
-                    elif feat.type.lower() == "cds":
+                    proteins.append((key, {
+                        "record_id": record_id,
+                        "gene": gene,
+                        "product": product,
+                        "protein_seq": prot_seq,
+                        "aa_length": aa_len,
+                        "location": location,
+                        "source_file": gbk.name
+                    }))
+                    
+                    if cluster_info is not None:
                         # Informações dos genes do cluster
-                        qualifiers = feat.qualifiers
-                        gene = qualifiers.get("gene", qualifiers.get("locus_tag", [""]))[0]
-                        product = qualifiers.get("product", [""])[0]
-                        gene_functions = qualifiers.get("gene_functions", [])
-                        gene_kind = qualifiers.get("gene_kind", [""])[0]
-                        sec_met_domain = qualifiers.get("sec_met_domain", [])
-                        
-                        # Extrair função mais específica
-                        if not product and gene_functions:
-                            for func in gene_functions:
-                                if ":" in func:
-                                    product = func.split(":")[-1].strip()
-                                    break
-                        
-                        if not product and gene_kind:
-                            product = gene_kind
-                        
-                        gene_info = {
+                        cluster_product, gene_functions, gene_kind, sec_met_domain = classify_cds(qualifiers)
+                        cluster_info["genes"].append({
                             "gene": gene,
-                            "product": product,
-                            "location": str(feat.location),
+                            "product": cluster_product,
+                            "location": location,
                             "gene_functions": gene_functions,
                             "sec_met_domain": sec_met_domain,
                             "gene_kind": gene_kind
-                        }
-                        cluster_info["genes"].append(gene_info)
+                        })
                 
+                elif ftype == "region" and cluster_info is not None:
+                    # Informações do cluster principal
+                    products = qualifiers.get("product", [])
+                    if products:
+                        cluster_info["products"] = products
+                        cluster_info["cluster_type"] = " + ".join(products)
+                    
+                    # Localização do cluster
+                    cluster_info["location_start"], cluster_info["location_end"], _ = location
+            
+            if cluster_info is not None:
                 # Adicionar informações calculadas
                 cluster_info["gene_count"] = len(cluster_info["genes"])
                 cluster_info["size_kb"] = round(cluster_info["sequence_length"] / 1000, 2)
@@ -335,35 +481,116 @@ def parse_clusters_from_regions(run_dir: Path):
                 cluster_info["regulatory_genes"] = len(regulatory_genes)
                 cluster_info["transport_genes"] = len(transport_genes)
                 
-                clusters.append(cluster_info)
-                break  # Só o primeiro record de cada arquivo
-                
-        except Exception as e:
-            app.logger.error(f"Error parsing cluster file {gbk}: {e}")
+                cluster = cluster_info
+    except Exception as e:
+        app.logger.error(f"Error parsing file {gbk}: {e}")
     
-    app.logger.info(f"Parsed {len(clusters)} clusters")
+    return proteins, cluster
+
+# Tamanho total dos arquivos region a partir do qual o pool de processos compensa com gb-io
+PARALLEL_PARSE_MIN_BYTES = 64 * 1024 * 1024
+
+def partition_gbk_files(run_dir: Path):
+    """Uma única varredura do diretório, separando (arquivos principais, arquivos region)"""
+    main_files, region_files = [], []
+    for gbk in sorted(run_dir.rglob("*.gbk")):
+        if is_region_file(gbk):
+            region_files.append(gbk)
+        else:
+            main_files.append(gbk)
+    return main_files, region_files
+
+def parse_region_clusters(run_dir: Path):
+    """
+    Parse only the region files under run_dir and return their cluster dicts.
+    Used for old runs whose results.json has no clusters (skips the main genome file).
+    """
+    _, region_files = partition_gbk_files(run_dir)
+    clusters = []
+    for gbk in region_files:
+        _, cluster_info = _parse_one_gbk(str(gbk), True)
+        if cluster_info is not None:
+            clusters.append(cluster_info)
     return clusters
 
+def parse_gbk_all(run_dir: Path):
+    """
+    Parse all .gbk files under run_dir (in a process pool when that pays off).
+    Returns (proteins, clusters):
+    - proteins: list of protein dicts (record_id, gene, product, protein_seq, aa_length,
+      location, source_file), prioritizing functional annotations from region files
+      over the main sequence file.
+    - clusters: list of cluster dicts with metadata and genes, one per region file.
+    """
+    proteins = []
+    proteins_by_gene = {}  # Para agrupar por gene e priorizar anotações
+    clusters = []
+    
+    main_files, region_files = partition_gbk_files(run_dir)
+    app.logger.info(f"Found {len(main_files)} main files and {len(region_files)} region files")
+    
+    # Arquivos principais primeiro, regions depois (as anotações dos regions sobrescrevem)
+    gbk_files = main_files + region_files
+    region_flags = [False] * len(main_files) + [True] * len(region_files)
+    
+    # Arquivos independentes: parsear em paralelo só quando compensa. Com gb-io o arquivo principal
+    # (que não se divide) domina e o pool só custa a subida dos processos, a menos que os regions
+    # sejam muito grandes. Até EXECUTOR_MAX_WORKERS jobs rodam ao mesmo tempo, então cada um fica
+    # com sua fração dos núcleos. forkserver: evita fork de um processo com várias threads.
+    max_workers = 0
+    if gb_io is None or sum(gbk.stat().st_size for gbk in region_files) >= PARALLEL_PARSE_MIN_BYTES:
+        cores_per_job = (os.cpu_count() or 1) // app.config["EXECUTOR_MAX_WORKERS"]
+        max_workers = min(len(gbk_files), cores_per_job)
+    if max_workers > 1:
+        mp_context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as pool:
+            results = list(pool.map(_parse_one_gbk, map(str, gbk_files), region_flags, chunksize=4))
+    else:
+        results = [_parse_one_gbk(str(gbk), is_region) for gbk, is_region in zip(gbk_files, region_flags)]
+    
+    # Juntar os resultados na ordem dos arquivos
+    for gbk, is_region, (file_proteins, cluster_info) in zip(gbk_files, region_flags, results):
+        for key, protein_data in file_proteins:
+            # Se já existe, atualizar com informações do region (prioritárias)
+            if is_region and key in proteins_by_gene:
+                # Priorizar anotação funcional do region se estiver preenchida
+                if protein_data["product"].strip():
+                    proteins_by_gene[key]["product"] = protein_data["product"]
+                proteins_by_gene[key]["source_file"] = f"{proteins_by_gene[key]['source_file']} + {gbk.name}"
+            else:
+                proteins_by_gene[key] = protein_data
+        
+        if cluster_info is not None:
+            clusters.append(cluster_info)
+    
+    proteins.extend(proteins_by_gene.values())
+    
+    app.logger.info(f"Parsed {len(proteins)} total proteins and {len(clusters)} clusters")
+    
+    return proteins, clusters
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
-def run_antismash_background(saved_path, run_name, run_id):
-    """Executa antiSMASH em background thread"""
+def run_antismash_background(saved_path, run_name, run_id, file_hash):
+    """Executa antiSMASH em background (pool do executor)"""
     try:
         run_dir = run_antismash_docker(saved_path, run_name, run_id)
-        proteins = parse_gbk_for_proteins(run_dir)
-        clusters = parse_clusters_from_regions(run_dir)
+        proteins, clusters = parse_gbk_all(run_dir)
         
-        # Salvar resultados
+        # Salvar resultados (sequências à parte, no proteins.fasta)
+        write_protein_fasta(RUNS_FOLDER / run_name / "proteins.fasta", proteins)
         results_file = RUNS_FOLDER / run_name / "results.json"
-        with open(results_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'proteins': proteins,
-                'clusters': clusters,
-                'run_name': run_name,
-                'completed_at': datetime.utcnow().isoformat()
-            }, f, ensure_ascii=False, indent=2)
+        write_results(results_file, {
+            'proteins': proteins,
+            'clusters': clusters,
+            'run_name': run_name,
+            'completed_at': datetime.utcnow().isoformat()
+        })
+        
+        # Registrar o run para reaproveitar em uploads do mesmo arquivo
+        (HASH_INDEX_FOLDER / file_hash).write_text(run_name, encoding="utf-8")
         
         update_progress(run_id, "completed", "Análise concluída!", 100)
         
@@ -388,16 +615,28 @@ def upload():
     unique_prefix = datetime.utcnow().strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:6]
     saved_name = f"{unique_prefix}_{filename}"
     saved_path = UPLOAD_FOLDER / saved_name
-    file.save(str(saved_path))
+    
+    # Salvar em blocos calculando o hash do conteúdo na mesma passada
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(saved_path, "wb") as out:
+        while chunk := file.stream.read(1 << 20):
+            hasher.update(chunk)
+            out.write(chunk)
+    file_hash = hasher.hexdigest()
+    
+    # Arquivo idêntico já analisado: mostrar os resultados existentes sem rodar o antiSMASH
+    cached_run = find_cached_run(file_hash)
+    if cached_run:
+        app.logger.info(f"Upload {file_hash} já analisado em {cached_run}")
+        saved_path.unlink()
+        return redirect(url_for("results", run_name=cached_run))
 
     run_name = "run_" + datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     run_id = uuid.uuid4().hex
     
-    # Iniciar processamento em background
-    update_progress(run_id, "starting", "Iniciando processamento...", 0)
-    thread = threading.Thread(target=run_antismash_background, args=(saved_path, run_name, run_id))
-    thread.daemon = True
-    thread.start()
+    # Enfileirar processamento em background
+    update_progress(run_id, "queued", "Aguardando na fila de execução...", 0)
+    executor.submit_stored(run_id, run_antismash_background, saved_path, run_name, run_id, file_hash)
     
     # Redirecionar para página de progresso
     return redirect(url_for("progress", run_id=run_id, run_name=run_name))
@@ -410,10 +649,32 @@ def progress(run_id, run_name):
 @app.route("/api/progress/<run_id>")
 def get_progress(run_id):
     """API para obter progresso atual"""
-    if run_id in progress_data:
-        return jsonify(progress_data[run_id])
+    # Job finalizado: liberar o future e registrar falhas não tratadas.
+    # Outra requisição (outra aba) pode ter feito o pop antes: future None
+    if executor.futures.done(run_id):
+        future = executor.futures.pop(run_id)
+        if future is not None and future.exception() is not None:
+            update_progress(run_id, "error", f"Erro: {future.exception()}", None)
+    
+    progress = get_run_progress(run_id)
+    if progress is not None:
+        return jsonify(progress.to_dict())
     return jsonify({"step": "unknown", "message": "Run não encontrado", "percentage": None})
 
+@lru_cache(maxsize=32)
+def load_results(run_name, mtime_ns):
+    """
+    Lê os resultados de um run, com cache em memória.
+    mtime_ns faz parte da chave: se o results.json for reescrito, o cache é invalidado.
+    """
+    data = read_results(RUNS_FOLDER / run_name / "results.json")
+    
+    # Se não tem clusters (arquivos antigos), parsear agora só os arquivos region
+    if 'clusters' not in data:
+        data['clusters'] = parse_region_clusters(RUNS_FOLDER / run_name)
+    
+    return data
+
 @app.route("/results/<run_name>")
 def results(run_name):
     """Página de resultados (redirecionamento da página de progresso)"""
@@ -422,21 +683,35 @@ def results(run_name):
         flash("Resultados não encontrados.")
         return redirect(url_for("index"))
     
-    with open(results_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Se não tem clusters (arquivos antigos), parsear agora
-    clusters = data.get('clusters', [])
-    if not clusters:
-        run_dir = RUNS_FOLDER / run_name
-        if run_dir.exists():
-            clusters = parse_clusters_from_regions(run_dir)
+    data = load_results(run_name, results_file.stat().st_mtime_ns)
     
     return render_template("results.html", 
                          proteins=data['proteins'], 
-                         clusters=clusters,
+                         clusters=data['clusters'],
                          run_name=run_name)
 
+@app.route("/protein/<run_name>/<int:index>")
+def protein_sequence(run_name, index):
+    """Sequência de aminoácidos de uma proteína, lida do proteins.fasta via mmap"""
+    results_file = RUNS_FOLDER / run_name / "results.json"
+    if not results_file.exists():
+        return "Run não encontrado", 404
+    
+    proteins = load_results(run_name, results_file.stat().st_mtime_ns)['proteins']
+    if index >= len(proteins):
+        return "Proteína não encontrada", 404
+    protein = proteins[index]
+    
+    # Runs antigos guardam a sequência no próprio results.json
+    if "protein_seq" in protein:
+        return Response(protein["protein_seq"], mimetype="text/plain")
+    
+    start = protein["seq_offset"]
+    with open(RUNS_FOLDER / run_name / "proteins.fasta", "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            seq = mm[start:start + protein["aa_length"]].decode("ascii")
+    return Response(seq, mimetype="text/plain")
+
 @app.route("/download_run/<run_name>/<path:filename>")
 def download_run_file(run_name, filename):
     target_dir = RUNS_FOLDER / run_name
@@ -446,4 +721,5 @@ def download_run_file(run_name, filename):
 
 if __name__ == "__main__":
     # Desenvolvimento: host 0.0.0.0 para testar de outros hosts se necessário
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Produção: gunicorn -c gunicorn_conf.py app:app
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_ENV") == "development")
\ No newline at end of file
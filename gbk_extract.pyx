@@ -0,0 +1,79 @@
+# cython: language_level=3
+"""
+Versão compilada das funções de extração de qualifiers usadas em app.py.
+Deve se comportar exatamente como as versões em Python puro de app.py.
+Build: python setup.py build_ext --inplace
+"""
+
+
+cdef inline str first_qualifier(dict qualifiers, str key):
+    """Primeiro valor de um qualifier, ou "" se ausente"""
+    cdef list values = qualifiers.get(key)
+    return values[0] if values else ""
+
+
+cpdef str extract_functional_annotation(dict qualifiers):
+    """Extrai anotação funcional de vários campos possíveis"""
+    cdef str product, gene_kind, func, func_lower, func_type, domain, domain_name
+    cdef list gene_functions, sec_met_domain
+
+    # Prioridade: product > gene_functions > gene_kind
+    product = first_qualifier(qualifiers, "product").strip()
+    if product:
+        return product
+
+    # Extrair de gene_functions (comum no antiSMASH)
+    gene_functions = qualifiers.get("gene_functions", [])
+    for func in gene_functions:
+        func_lower = func.lower()
+        if "biosynthetic" in func_lower:
+            # Extrair o tipo de função
+            if ":" in func:
+                func_type = func.split(":")[-1].strip()
+                if func_type:
+                    return func_type
+            elif ")" in func:
+                func_type = func.split(")")[-1].strip()
+                if func_type:
+                    return func_type
+
+    # Extrair de gene_kind
+    gene_kind = first_qualifier(qualifiers, "gene_kind").strip()
+    if gene_kind:
+        return gene_kind
+
+    # Extrair de sec_met_domain
+    sec_met_domain = qualifiers.get("sec_met_domain", [])
+    for domain in sec_met_domain:
+        if "(" in domain:
+            domain_name = domain.split("(")[0].strip()
+            if domain_name:
+                return f"domain: {domain_name}"
+
+    return ""
+
+
+cpdef tuple classify_cds(dict qualifiers):
+    """
+    Extrai os campos de um gene de cluster.
+    Retorna (product, gene_functions, gene_kind, sec_met_domain).
+    """
+    cdef str product, gene_kind, func
+    cdef list gene_functions, sec_met_domain
+
+    product = first_qualifier(qualifiers, "product")
+    gene_functions = qualifiers.get("gene_functions", [])
+    gene_kind = first_qualifier(qualifiers, "gene_kind")
+    sec_met_domain = qualifiers.get("sec_met_domain", [])
+
+    # Extrair função mais específica
+    if not product and gene_functions:
+        for func in gene_functions:
+            if ":" in func:
+                product = func.split(":")[-1].strip()
+                break
+
+    if not product and gene_kind:
+        product = gene_kind
+
+    return product, gene_functions, gene_kind, sec_met_domain
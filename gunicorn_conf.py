@@ -0,0 +1,15 @@
+"""
+Configuração do gunicorn para produção:
+  gunicorn -c gunicorn_conf.py app:app
+Workers gthread: o polling de /api/progress, uploads e páginas de resultado são
+atendidos em paralelo enquanto o antiSMASH roda.
+"""
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+worker_class = "gthread"
+# Sem REDIS_URL o progresso fica na memória de cada processo: use um único worker
+workers = int(os.environ.get("GUNICORN_WORKERS", 2 if os.environ.get("REDIS_URL") else 1))
+threads = 8
+# Uploads de genomas grandes podem demorar; não matar workers por timeout
+timeout = 0
@@ -0,0 +1,12 @@
+"""
+Build da extensão Cython opcional (gbk_extract).
+Uso: python setup.py build_ext --inplace
+Sem ela, app.py usa as versões em Python puro.
+"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="antismash-web-extensions",
+    ext_modules=cythonize("gbk_extract.pyx", language_level=3),
+)